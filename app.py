@@ -1,163 +1,444 @@
-import streamlit as st
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap
-from matplotlib.patches import Patch
-
-# --- Streamlit 設定 ---
-st.set_page_config(page_title="Fe–H2O Pourbaix Diagram", layout="wide")
-st.markdown("""
-<div style="background: linear-gradient(135deg,#0f172a,#1e3a8a);
-            color:white; padding:1.5rem; border-radius:12px; text-align:center;">
-    <h1>Fe–H2O Pourbaix Diagram (Oxides / Hydroxides selectable)</h1>
-</div>
-""", unsafe_allow_html=True)
-
-# --- サイドバー ---
-with st.sidebar:
-    st.header("Parameters")
-    temp_c = st.slider("Temperature [°C]", 0, 100, 25)
-    log_a_fe2 = st.number_input("log10(Fe2+ activity)", value=-6.0, format="%.1f")
-    log_a_fe3 = st.number_input("log10(Fe3+ activity)", value=-6.0, format="%.1f")
-    phase_type = st.radio("Select phase type", ["Oxides only", "Hydroxides only"])
-    show_boundary = st.checkbox("Show boundary lines", value=True)
-
-    # (5) 表示切替：沈殿領域だけ強調表示
-    highlight_precip_only = st.checkbox("Highlight precipitation only", value=True)
-
-# --- 定数 ---
-F = 96485.3
-R = 8.31446
-T = 273.15 + temp_c
-S = R*T*np.log(10)/F
-act_fe2 = log_a_fe2 * S
-act_fe3 = log_a_fe3 * S
-G_H2O = -237130  # J/mol
-
-# --- 標準生成ギブズ [J/mol] ---
-Gf = {
-    "Fe": 0.0,
-    "Fe2+": -78900,
-    "Fe3+": -4700,
-    "Fe(OH)2": -486500,
-    "Fe(OH)3": -696500,
-    "Fe3O4": -1015400,
-    "Fe2O3": -742200,
-    "HFeO2-": -379000
-}
-
-# --- Meshgrid ---
-res = 600
-ph_vec = np.linspace(0, 14, res)
-e_vec = np.linspace(-2.5, 2.5, res)
-PH, E = np.meshgrid(ph_vec, e_vec)
-
-# --- Psi 計算関数 ---
-def calc_psi(PH, E, phase_type):
-    Psi = {}
-    Psi["Fe"] = np.full_like(PH, Gf["Fe"]/F)
-    Psi["Fe2+"] = Gf["Fe2+"]/F + act_fe2 - 2*E
-    Psi["Fe3+"] = Gf["Fe3+"]/F + act_fe3 - 3*E
-    Psi["HFeO2-"] = (Gf["HFeO2-"] - 2*G_H2O)/F - 2*E - 3*S*PH + act_fe2
-
-    if phase_type == "Hydroxides only":
-        Psi["Fe(OH)2"] = (Gf["Fe(OH)2"] - 2*G_H2O)/F - 2*E - 2*S*PH + act_fe2
-        Psi["Fe(OH)3"] = (Gf["Fe(OH)3"] - 3*G_H2O)/F - 3*E - 3*S*PH + act_fe3
-    else:  # Oxides only
-        Psi["Fe3O4"] = ((Gf["Fe3O4"] - 4*G_H2O)/F - 8*E - 8*S*PH)/3
-        Psi["Fe2O3"] = ((Gf["Fe2O3"] - 3*G_H2O)/F - 6*E - 6*S*PH)/2
-
-    return Psi
-
-Psi_dict = calc_psi(PH, E, phase_type)
-
-# --- 使用フェーズキー選択 ---
-if phase_type == "Hydroxides only":
-    psi_keys = ["Fe", "Fe2+", "Fe3+", "Fe(OH)2", "Fe(OH)3", "HFeO2-"]
-    precip_phases = ["Fe(OH)2", "Fe(OH)3"]
-else:
-    psi_keys = ["Fe", "Fe2+", "Fe3+", "Fe3O4", "Fe2O3", "HFeO2-"]
-    precip_phases = ["Fe3O4", "Fe2O3"]
-
-Psi_stack = np.stack([Psi_dict[k] for k in psi_keys], axis=0)
-phase_map = np.argmin(Psi_stack, axis=0)
-
-# --- 沈殿領域マスク作成（固相が最安定の領域） ---
-precip_indices = [psi_keys.index(p) for p in precip_phases if p in psi_keys]
-precip_mask = np.isin(phase_map, precip_indices)
-
-# --- 描画 ---
-fig, ax = plt.subplots(figsize=(10, 8), dpi=120)
-
-if highlight_precip_only:
-    # 0: 非沈殿（グレー）, 1: 沈殿（色）
-    # ※色はここで1色だけに統一（例：赤）
-    show_map = precip_mask.astype(int)
-    cmap2 = ListedColormap(["#9ca3af", "#ef4444"])  # 灰 + 赤
-    ax.imshow(
-        show_map,
-        origin='lower',
-        cmap=cmap2,
-        extent=[0, 14, -2.5, 2.5],
-        aspect='auto'
-    )
-else:
-    # 従来どおり相をカラフル表示（参考として残す）
-    colors = ['#94a3b8','#3b82f6','#facc15','#60a5fa','#f87171','#a855f7','#22c55e','#fb923c']
-    ax.imshow(
-        phase_map,
-        origin='lower',
-        cmap=ListedColormap(colors[:len(psi_keys)]),
-        extent=[0, 14, -2.5, 2.5],
-        aspect='auto'
-    )
-    # 半透明で沈殿を重ねる
-    ax.contourf(PH, E, precip_mask.astype(int), levels=[0.5, 1.5], colors=["black"], alpha=0.18)
-
-# 水の分解線
-ax.plot(ph_vec, 1.229 - S*ph_vec, 'k--', alpha=0.4)
-ax.plot(ph_vec, 0.0 - S*ph_vec, 'k--', alpha=0.4)
-
-# 境界線（相境界なので、沈殿だけ強調モードでも引ける）
-if show_boundary:
-    line_style = {'colors': 'white', 'linewidths': 0.7, 'alpha': 0.6}
-    psi_list = [Psi_dict[k] for k in psi_keys]
-    for i in range(len(psi_list)):
-        for j in range(i+1, len(psi_list)):
-            ax.contour(PH, E, psi_list[i] - psi_list[j], levels=[0], **line_style)
-
-# 沈殿相ラベル（沈殿だけ強調表示のときに限定して表示）
-if highlight_precip_only:
-    for p in precip_phases:
-        if p in psi_keys:
-            idx = psi_keys.index(p)
-            mask = (phase_map == idx)
-            if np.any(mask):
-                ph_c = PH[mask].mean()
-                e_c = E[mask].mean()
-                ax.text(
-                    ph_c, e_c, p, color='black', fontsize=10, ha='center', va='center',
-                    bbox=dict(facecolor='white', alpha=0.8, edgecolor='none', boxstyle='round')
-                )
-
-ax.set_xlabel("pH")
-ax.set_ylabel("Potential E [V vs SHE]")
-ax.set_xlim(0, 14)
-ax.set_ylim(-2.5, 2.5)
-ax.grid(alpha=0.1)
-ax.set_title(
-    f"Fe–H2O Pourbaix Diagram @ {temp_c}°C, log a(Fe2+)={log_a_fe2}, log a(Fe3+)={log_a_fe3}"
-)
-
-# 凡例（沈殿／非沈殿）
-if highlight_precip_only:
-    leg = [
-        Patch(facecolor="#ef4444", edgecolor="none", label="Precipitation (solid stable)"),
-        Patch(facecolor="#9ca3af", edgecolor="none", label="No precipitation (aqueous/metal stable)")
-    ]
-    ax.legend(handles=leg, loc="upper right", framealpha=0.95)
-
-st.pyplot(fig)
-
-
-
+import streamlit as st
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import ListedColormap
+from matplotlib.patches import Patch
+from PIL import Image, ImageDraw
+from scipy.ndimage import center_of_mass
+from scipy.optimize import linprog
+from scipy.spatial import HalfspaceIntersection, QhullError
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# --- Streamlit 設定 ---
+st.set_page_config(page_title="Fe–H2O Pourbaix Diagram", layout="wide")
+st.markdown("""
+<div style="background: linear-gradient(135deg,#0f172a,#1e3a8a);
+            color:white; padding:1.5rem; border-radius:12px; text-align:center;">
+    <h1>Fe–H2O Pourbaix Diagram (Oxides / Hydroxides selectable)</h1>
+</div>
+""", unsafe_allow_html=True)
+
+# --- サイドバー ---
+# フォームでまとめて送信：スライダー操作の途中値では再計算しない
+with st.sidebar.form("params", clear_on_submit=False):
+    st.header("Parameters")
+    temp_c = st.slider("Temperature [°C]", 0, 100, 25)
+    log_a_fe2 = st.number_input("log10(Fe2+ activity)", value=-6.0, format="%.1f")
+    log_a_fe3 = st.number_input("log10(Fe3+ activity)", value=-6.0, format="%.1f")
+    phase_type = st.radio("Select phase type", ["Oxides only", "Hydroxides only"])
+    res = st.select_slider("Grid resolution", options=[100, 150, 200, 300, 450, 600], value=200)
+
+    submitted = st.form_submit_button("Recompute")
+
+# 表示だけに効くフラグはフォームの外：切り替えは即リランされるが、
+# 計算パラメータは変わらないので compute_phase_map はキャッシュ命中する
+with st.sidebar:
+    show_boundary = st.checkbox("Show boundary lines", value=True)
+
+    # (5) 表示切替：沈殿領域だけ強調表示
+    highlight_precip_only = st.checkbox("Highlight precipitation only", value=True)
+
+    # 軸・グリッド付きの matplotlib 描画（重い）を使いたいとき用
+    use_matplotlib = st.checkbox("Matplotlib renderer (advanced)", value=False)
+
+    # 事前計算テーブルの最近傍スライスを使う（パラメータは格子点に丸められる）
+    fast_preview = st.checkbox("Fast preview (precomputed table)", value=False)
+
+# --- 定数 ---
+F = 96485.3
+R = 8.31446
+G_H2O = -237130  # J/mol
+
+# --- 標準生成ギブズ [J/mol] ---
+Gf = {
+    "Fe": 0.0,
+    "Fe2+": -78900,
+    "Fe3+": -4700,
+    "Fe(OH)2": -486500,
+    "Fe(OH)3": -696500,
+    "Fe3O4": -1015400,
+    "Fe2O3": -742200,
+    "HFeO2-": -379000
+}
+
+# --- カラーマップ・凡例（リランごとに作り直さない） ---
+PHASE_COLORS = ['#94a3b8','#3b82f6','#facc15','#60a5fa','#f87171','#a855f7','#22c55e','#fb923c']
+CMAP_PRECIP = ListedColormap(["#9ca3af", "#ef4444"])  # 灰 + 赤
+CMAP_PHASE = ListedColormap(PHASE_COLORS[:6])  # どちらの phase_type も 6 相
+LEGEND_HANDLES = [
+    Patch(facecolor="#ef4444", edgecolor="none", label="Precipitation (solid stable)"),
+    Patch(facecolor="#9ca3af", edgecolor="none", label="No precipitation (aqueous/metal stable)")
+]
+PRECIP_PALETTE = np.array([[156, 163, 175], [239, 68, 68]], dtype=np.uint8)  # 灰 + 赤（RGB）
+
+# --- アフィン係数テーブル ---
+# 各 Psi は Psi_k(pH, E) = a_k + b_k*pH + c_k*E の形。
+# 係数配列 (a, b, c) にまとめて Numba カーネルと NumPy 経路で共用する
+def phase_coeffs(phase_type, S, act_fe2, act_fe3):
+    coeffs = {
+        "Fe":     (Gf["Fe"]/F, 0.0, 0.0),
+        "Fe2+":   (Gf["Fe2+"]/F + act_fe2, 0.0, -2.0),
+        "Fe3+":   (Gf["Fe3+"]/F + act_fe3, 0.0, -3.0),
+        "HFeO2-": ((Gf["HFeO2-"] - 2*G_H2O)/F + act_fe2, -3*S, -2.0),
+        "Fe(OH)2": ((Gf["Fe(OH)2"] - 2*G_H2O)/F + act_fe2, -2*S, -2.0),
+        "Fe(OH)3": ((Gf["Fe(OH)3"] - 3*G_H2O)/F + act_fe3, -3*S, -3.0),
+        "Fe3O4":  ((Gf["Fe3O4"] - 4*G_H2O)/F/3, -8*S/3, -8.0/3),
+        "Fe2O3":  ((Gf["Fe2O3"] - 3*G_H2O)/F/2, -3*S, -3.0),
+    }
+
+    if phase_type == "Hydroxides only":
+        psi_keys = ["Fe", "Fe2+", "Fe3+", "Fe(OH)2", "Fe(OH)3", "HFeO2-"]
+    else:
+        psi_keys = ["Fe", "Fe2+", "Fe3+", "Fe3O4", "Fe2O3", "HFeO2-"]
+
+    # float32 で十分な精度（物理定数は有効 6 桁程度）。バンド幅半減
+    a = np.array([coeffs[k][0] for k in psi_keys], dtype=np.float32)
+    b = np.array([coeffs[k][1] for k in psi_keys], dtype=np.float32)
+    c = np.array([coeffs[k][2] for k in psi_keys], dtype=np.float32)
+    return a, b, c, psi_keys
+
+if NUMBA_AVAILABLE:
+    # 相評価と argmin を 1 パスに融合したカーネル（行単位で並列化）
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _phase_map_kernel(ph_vec, e_vec, a, b, c):
+        n_phase = a.shape[0]
+        out = np.empty((e_vec.shape[0], ph_vec.shape[0]), np.uint8)
+        for i in numba.prange(e_vec.shape[0]):
+            e = e_vec[i]
+            for j in range(ph_vec.shape[0]):
+                ph = ph_vec[j]
+                best = 0
+                best_val = a[0] + b[0]*ph + c[0]*e
+                for k in range(1, n_phase):
+                    v = a[k] + b[k]*ph + c[k]*e
+                    if v < best_val:
+                        best_val = v
+                        best = k
+                out[i, j] = best
+        return out
+
+# Numba が使えないときの NumPy 経路。
+# 逐次リダクションで最小相を決定（(6, res, res) のスタックを作らない）
+# 1 次元評価の Psi はここで初めて (res_y, res_x) にブロードキャストする
+def _phase_map_numpy(ph_vec, e_vec, a, b, c):
+    shape = (e_vec.shape[0], ph_vec.shape[0])
+    psi = [a[i] + b[i]*ph_vec[None, :] + c[i]*e_vec[:, None] for i in range(len(a))]
+    best_val = np.broadcast_to(psi[0], shape).copy()
+    best_idx = np.zeros_like(best_val, dtype=np.uint8)
+    mask = np.empty(shape, dtype=bool)  # 比較結果の一時配列は 1 回だけ確保
+    for i in range(1, len(psi)):
+        arr = np.broadcast_to(psi[i], shape)
+        np.less(arr, best_val, out=mask)
+        np.copyto(best_val, arr, where=mask)
+        best_idx[mask] = i
+    return best_idx
+
+# --- 事前計算 LUT ---
+# Psi は 3 つのユーザーパラメータに線形なので、相マップは
+# (temp_c, log_a_fe2, log_a_fe3) の決定的な関数。粗いパラメータ格子で
+# 一括計算して保持し、最近傍スライスを返すだけの高速プレビューに使う
+LUT_TEMPS = np.arange(0, 101, 5)        # 21 点
+LUT_LOG_A = np.arange(-8.0, -2.9, 0.5)  # 11 点
+LUT_RES = 150
+
+@st.cache_resource
+def load_phase_map_lut(phase_type):
+    ph_vec = np.linspace(0, 14, LUT_RES, dtype=np.float32)
+    e_vec = np.linspace(-2.5, 2.5, LUT_RES, dtype=np.float32)
+    lut = np.empty(
+        (len(LUT_TEMPS), len(LUT_LOG_A), len(LUT_LOG_A), LUT_RES, LUT_RES),
+        dtype=np.uint8
+    )
+    for ti, t in enumerate(LUT_TEMPS):
+        S = R*(273.15 + t)*np.log(10)/F
+        for i2, la2 in enumerate(LUT_LOG_A):
+            for i3, la3 in enumerate(LUT_LOG_A):
+                a, b, c, _ = phase_coeffs(phase_type, S, la2*S, la3*S)
+                if NUMBA_AVAILABLE:
+                    lut[ti, i2, i3] = _phase_map_kernel(ph_vec, e_vec, a, b, c)
+                else:
+                    lut[ti, i2, i3] = _phase_map_numpy(ph_vec, e_vec, a, b, c)
+    return lut
+
+# --- 解析的な相境界 ---
+# Psi はすべて (pH, E) のアフィン関数なので、最小相の分割は凸多角形の
+# 集まり（下側包絡線）になり、グリッドなしで閉形式に求まる。
+# 相 k の領域 = {Psi_k <= Psi_i (i != k)} と描画枠の半空間交差
+def phase_polygons(a, b, c):
+    box = np.array([
+        [-1.0, 0.0, 0.0],    # pH >= 0
+        [1.0, 0.0, -14.0],   # pH <= 14
+        [0.0, -1.0, -2.5],   # E >= -2.5
+        [0.0, 1.0, -2.5],    # E <= 2.5
+    ])
+    polygons = []
+    for k in range(len(a)):
+        rows = [
+            [b[k] - b[i], c[k] - c[i], a[k] - a[i]]
+            for i in range(len(a)) if i != k
+        ]
+        halfspaces = np.vstack([np.array(rows, dtype=np.float64), box])
+        A = halfspaces[:, :2]
+        offs = halfspaces[:, 2]
+
+        # チェビシェフ中心を LP で求めて内点にする（半径 <= 0 なら領域は空）
+        norms = np.linalg.norm(A, axis=1, keepdims=True)
+        lp = linprog(
+            c=[0.0, 0.0, -1.0],
+            A_ub=np.hstack([A, norms]), b_ub=-offs,
+            bounds=[(None, None), (None, None), (0, None)],
+        )
+        if not lp.success or lp.x[2] < 1e-9:
+            polygons.append(None)
+            continue
+
+        interior = lp.x[:2]
+        try:
+            hs = HalfspaceIntersection(halfspaces, interior)
+        except QhullError:
+            polygons.append(None)
+            continue
+        verts = hs.intersections
+        order = np.argsort(np.arctan2(verts[:, 1] - interior[1], verts[:, 0] - interior[0]))
+        polygons.append(verts[order])
+    return polygons
+
+# 描画枠上に乗っている辺（多角形が枠で切られた部分）は境界線として引かない
+def _on_box_edge(p0, p1, tol=1e-9):
+    for axis, bound in [(0, 0.0), (0, 14.0), (1, -2.5), (1, 2.5)]:
+        if abs(p0[axis] - bound) < tol and abs(p1[axis] - bound) < tol:
+            return True
+    return False
+
+# --- 相マップ計算（パラメータが同じならキャッシュを再利用） ---
+@st.cache_data
+def compute_phase_map(temp_c, log_a_fe2, log_a_fe3, phase_type, res):
+    T = 273.15 + temp_c
+    S = R*T*np.log(10)/F
+    act_fe2 = log_a_fe2 * S
+    act_fe3 = log_a_fe3 * S
+
+    ph_vec = np.linspace(0, 14, res, dtype=np.float32)
+    e_vec = np.linspace(-2.5, 2.5, res, dtype=np.float32)
+
+    a, b, c, psi_keys = phase_coeffs(phase_type, S, act_fe2, act_fe3)
+
+    if NUMBA_AVAILABLE:
+        phase_map = _phase_map_kernel(ph_vec, e_vec, a, b, c)
+    else:
+        phase_map = _phase_map_numpy(ph_vec, e_vec, a, b, c)
+
+    return phase_map, psi_keys
+
+# --- 沈殿相ラベル位置 ---
+# 相ごとのマスク生成を繰り返さず、ラベル画像の重心を一括で求める
+def precip_label_positions(phase_map, psi_keys, precip_phases, ph_vec, e_vec):
+    res_y, res_x = phase_map.shape
+    counts = np.bincount(phase_map.ravel(), minlength=len(psi_keys))
+    label_indices = [
+        psi_keys.index(p) for p in precip_phases
+        if p in psi_keys and counts[psi_keys.index(p)] > 0
+    ]
+    if not label_indices:
+        return []
+    centroids = center_of_mass(
+        np.ones_like(phase_map), labels=phase_map, index=label_indices
+    )
+    return [
+        (np.interp(col_c, [0, res_x - 1], [ph_vec[0], ph_vec[-1]]),
+         np.interp(row_c, [0, res_y - 1], [e_vec[0], e_vec[-1]]),
+         psi_keys[idx])
+        for idx, (row_c, col_c) in zip(label_indices, centroids)
+    ]
+
+# --- Pillow 直接合成 ---
+# 沈殿強調ビューは 2 色ラスタ＋数本の線＋ラベルだけなので、matplotlib の
+# レイアウト・テキストエンジンを通さず RGB 配列から直接組み立てる
+def render_precip_image(precip_mask, S, boundary_polys, labels):
+    res_y, res_x = precip_mask.shape
+    rgb = PRECIP_PALETTE[precip_mask.astype(np.uint8)]
+    img = Image.fromarray(rgb[::-1])  # 行 0 を E 最大側にして上下を合わせる
+    draw = ImageDraw.Draw(img)
+
+    def to_px(ph, e):
+        return (ph / 14 * (res_x - 1), (2.5 - e) / 5.0 * (res_y - 1))
+
+    # 水の分解線
+    for e0 in (1.229, 0.0):
+        draw.line([to_px(0, e0), to_px(14, e0 - S * 14)], fill=(0, 0, 0), width=1)
+
+    # 相境界（解析多角形の辺。枠上の辺は引かない）
+    for verts in boundary_polys:
+        if verts is None or len(verts) < 3:
+            continue
+        closed = np.vstack([verts, verts[:1]])
+        for p0, p1 in zip(closed[:-1], closed[1:]):
+            if _on_box_edge(p0, p1):
+                continue
+            draw.line([to_px(*p0), to_px(*p1)], fill=(255, 255, 255), width=1)
+
+    for ph_c, e_c, text in labels:
+        draw.text(to_px(ph_c, e_c), text, fill=(0, 0, 0), anchor="mm")
+    return img
+
+# --- 計算＋描画 ---
+# ひとつの設定可能な関数に集約：表示バリエーションは引数で切り替え、
+# ファイルを複製せずに呼び出し側で差し替えられるようにする
+def render_pourbaix(temp_c, log_a_fe2, log_a_fe3, phase_type, res,
+                    show_boundary, highlight_precip_only, use_matplotlib=False,
+                    fast_preview=False):
+    T = 273.15 + temp_c
+    S = R*T*np.log(10)/F
+
+    if fast_preview:
+        # 最近傍の格子点スライスを取り出すだけ（計算は初回の表構築のみ）
+        lut = load_phase_map_lut(phase_type)
+        ti = int(np.abs(LUT_TEMPS - temp_c).argmin())
+        i2 = int(np.abs(LUT_LOG_A - log_a_fe2).argmin())
+        i3 = int(np.abs(LUT_LOG_A - log_a_fe3).argmin())
+        phase_map = lut[ti, i2, i3]
+        res = LUT_RES
+        psi_keys = phase_coeffs(phase_type, S, 0.0, 0.0)[3]
+    else:
+        phase_map, psi_keys = compute_phase_map(
+            temp_c, log_a_fe2, log_a_fe3, phase_type, res
+        )
+
+    ph_vec = np.linspace(0, 14, res, dtype=np.float32)
+    e_vec = np.linspace(-2.5, 2.5, res, dtype=np.float32)
+
+    # --- 沈殿フェーズ選択 ---
+    if phase_type == "Hydroxides only":
+        precip_phases = ["Fe(OH)2", "Fe(OH)3"]
+    else:
+        precip_phases = ["Fe3O4", "Fe2O3"]
+
+    # --- 沈殿領域マスク作成（固相が最安定の領域） ---
+    # uint8 の phase_map をブール LUT で引くだけ（np.isin の sort/searchsorted 経路を回避）
+    precip_lut = np.zeros(len(psi_keys), dtype=bool)
+    for p in precip_phases:
+        if p in psi_keys:
+            precip_lut[psi_keys.index(p)] = True
+    precip_mask = precip_lut[phase_map]
+
+    # --- 沈殿強調ビューは既定で Pillow 直接合成（st.image 出力） ---
+    if highlight_precip_only and not use_matplotlib:
+        if show_boundary:
+            a, b, c, _ = phase_coeffs(phase_type, S, log_a_fe2 * S, log_a_fe3 * S)
+            boundary_polys = phase_polygons(a, b, c)
+        else:
+            boundary_polys = []
+        labels = precip_label_positions(phase_map, psi_keys, precip_phases, ph_vec, e_vec)
+        img = render_precip_image(precip_mask, S, boundary_polys, labels)
+        st.image(
+            img, width="stretch",
+            caption=f"Fe–H2O Pourbaix Diagram @ {temp_c}°C, "
+                    f"log a(Fe2+)={log_a_fe2}, log a(Fe3+)={log_a_fe3}"
+        )
+        return
+
+    # --- 描画 ---
+    # Figure/Axes は session_state に保持して再利用（毎リランの生成コストを回避）
+    if "fig" not in st.session_state:
+        st.session_state["fig"], st.session_state["ax"] = plt.subplots(figsize=(10, 8), dpi=120)
+    fig = st.session_state["fig"]
+    ax = st.session_state["ax"]
+
+    # 前回リランの描画物を消してから上書きする（水の分解線は再利用するので残す）
+    water_lines = st.session_state.get("water_lines", ())
+    for artist in list(ax.collections) + list(ax.lines) + list(ax.texts):
+        if artist in water_lines:
+            continue
+        artist.remove()
+    if ax.get_legend() is not None:
+        ax.get_legend().remove()
+
+    if highlight_precip_only:
+        # 0: 非沈殿（グレー）, 1: 沈殿（色）
+        # ※色はここで1色だけに統一（例：赤）
+        show_map = precip_mask.astype(int)
+        ax.pcolormesh(
+            ph_vec, e_vec, show_map,
+            cmap=CMAP_PRECIP, vmin=0, vmax=1, shading='nearest'
+        )
+    else:
+        # 従来どおり相をカラフル表示（参考として残す）
+        ax.pcolormesh(
+            ph_vec, e_vec, phase_map,
+            cmap=CMAP_PHASE,
+            vmin=0, vmax=len(psi_keys) - 1, shading='nearest'
+        )
+        # 半透明で沈殿を重ねる
+        ax.contourf(ph_vec, e_vec, precip_mask.astype(int), levels=[0.5, 1.5], colors=["black"], alpha=0.18)
+
+    # 水の分解線（Line2D を再利用し、データだけ差し替える）
+    slope = S * ph_vec
+    if water_lines:
+        o2_line, h2_line = water_lines
+        o2_line.set_data(ph_vec, 1.229 - slope)
+        h2_line.set_data(ph_vec, -slope)
+    else:
+        o2_line, = ax.plot(ph_vec, 1.229 - slope, 'k--', alpha=0.4)
+        h2_line, = ax.plot(ph_vec, -slope, 'k--', alpha=0.4)
+        st.session_state["water_lines"] = (o2_line, h2_line)
+
+    # 境界線（相境界なので、沈殿だけ強調モードでも引ける）
+    # アフィン性から各相領域は凸多角形：境界はグリッドを使わず閉形式で引く
+    if show_boundary:
+        a, b, c, _ = phase_coeffs(phase_type, S, log_a_fe2 * S, log_a_fe3 * S)
+        drawn = False
+        for verts in phase_polygons(a, b, c):
+            if verts is None or len(verts) < 3:
+                continue
+            closed = np.vstack([verts, verts[:1]])
+            for p0, p1 in zip(closed[:-1], closed[1:]):
+                if _on_box_edge(p0, p1):
+                    continue
+                ax.plot([p0[0], p1[0]], [p0[1], p1[1]],
+                        color='white', linewidth=0.7, alpha=0.6)
+                drawn = True
+        if not drawn:
+            # 多角形が作れない退化ケースは 2 倍解像度の相マップ等高線で代替
+            fine_res = res * 2
+            fine_map, _ = compute_phase_map(temp_c, log_a_fe2, log_a_fe3, phase_type, fine_res)
+            ph_fine = np.linspace(0, 14, fine_res, dtype=np.float32)
+            e_fine = np.linspace(-2.5, 2.5, fine_res, dtype=np.float32)
+            ax.contour(
+                ph_fine, e_fine, fine_map,
+                levels=np.arange(1, len(psi_keys)) - 0.5,
+                algorithm="serial",
+                colors='white', linewidths=0.7, alpha=0.6
+            )
+
+    # 沈殿相ラベル（沈殿だけ強調表示のときに限定して表示）
+    if highlight_precip_only:
+        for ph_c, e_c, text in precip_label_positions(
+                phase_map, psi_keys, precip_phases, ph_vec, e_vec):
+            ax.text(
+                ph_c, e_c, text, color='black', fontsize=10, ha='center', va='center',
+                bbox=dict(facecolor='white', alpha=0.8, edgecolor='none', boxstyle='round')
+            )
+
+    ax.set_xlabel("pH")
+    ax.set_ylabel("Potential E [V vs SHE]")
+    ax.set_xlim(0, 14)
+    ax.set_ylim(-2.5, 2.5)
+    ax.grid(alpha=0.1)
+    ax.set_title(
+        f"Fe–H2O Pourbaix Diagram @ {temp_c}°C, log a(Fe2+)={log_a_fe2}, log a(Fe3+)={log_a_fe3}"
+    )
+
+    # 凡例（沈殿／非沈殿）
+    if highlight_precip_only:
+        ax.legend(handles=LEGEND_HANDLES, loc="upper right", framealpha=0.95)
+
+    st.pyplot(fig)
+
+render_pourbaix(temp_c, log_a_fe2, log_a_fe3, phase_type, res,
+                show_boundary, highlight_precip_only, use_matplotlib,
+                fast_preview)